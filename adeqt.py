@@ -24,6 +24,7 @@ THE SOFTWARE.
 """
 import ast
 import builtins
+import collections
 import io
 import sys
 import tokenize
@@ -38,7 +39,11 @@ __version__ = "0.2"
 
 def add_prompt(code: str):
     lines = code.rstrip().splitlines(keepends=True)
-    return ''.join(['>>> ' + lines[0]] + ['... ' + l for l in lines[1:]]) + '\n'
+    if not lines:
+        return '\n'
+    return ''.join(
+        ('>>> ' if i == 0 else '... ') + l for i, l in enumerate(lines)
+    ) + '\n'
 
 
 class OutputStream:
@@ -50,7 +55,7 @@ class OutputStream:
         # self.widget.append(text)
 
     def flush(self):
-        pass
+        self.shell_widget.flush_output()
 
 
 class IncompleteToken(tokenize.TokenInfo):
@@ -66,42 +71,173 @@ def tokenize_maybe_incomplete(code: str):
         except StopIteration:
             break
         except tokenize.TokenError:
-            lines = [None] + code.splitlines()
+            # Token rows are 1-based, so index with row - 1
+            lines = code.splitlines()
             row, col = last_end
-            s = lines[row][col:] + ''.join(lines[row + 1:])
+            s = lines[row - 1][col:] + ''.join(lines[row:])
             if s and not s.isspace():
                 start = last_end
-                end = (len(lines) - 1, len(lines[-1]))
-                yield IncompleteToken(tokenize.STRING, s, start, end, lines[row])
+                end = (len(lines), len(lines[-1]))
+                yield IncompleteToken(tokenize.STRING, s, start, end, lines[row - 1])
+            return
         else:
             last_end = tok.end
             yield tok
 
 
+def _line_has_open_string(line: str):
+    """Check for an unterminated quote, with a cheap single pass over one line"""
+    quote = None
+    escaped = False
+    for ch in line:
+        if escaped:
+            escaped = False
+        elif quote:
+            if ch == '\\':
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in '\'"':
+            quote = ch
+    return quote is not None
+
+
+# QTextCursor.selectedText() uses U+2029 in place of newlines
+_LINE_BREAKS = ('\n', '\u2029')
+
+
 def get_dotted_name(code: str):
+    # Fast path: only the trailing dotted name matters, so scan backwards over
+    # identifier & dot characters rather than tokenizing the whole input.
+    i = len(code)
+    while i > 0 and (code[i-1].isalnum() or code[i-1] in '._'):
+        i -= 1
+    parts = code[i:].split('.')
+    line_start = max(code.rfind(b, 0, i) for b in _LINE_BREAKS) + 1
+    head = code[line_start:i]
+    if (
+            all(p.isidentifier() for p in parts[:-1])
+            and (parts[-1] == '' or parts[-1].isidentifier())
+            and '#' not in head
+            and not _line_has_open_string(head)
+    ):
+        return tuple(parts)
+
+    # The tail wasn't a plain dotted name (e.g. 'foo().bar', a string or a
+    # comment on this line) - fall back to tokenizing.
+    return _get_dotted_name_tokenize(code)
+
+
+def _get_dotted_name_tokenize(code: str):
+    # Only the trailing run of NAME/DOT tokens matters, so walk the tokens
+    # from the end and stop as soon as that pattern breaks.
+    tokens = list(tokenize_maybe_incomplete(code))
+    i = len(tokens) - 1
+    while i >= 0 and tokens[i].type in (
+            tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER
+    ):
+        # Some combination of these is added at the end of the input
+        i -= 1
+
+    trailing_dot = i >= 0 and tokens[i].exact_type == tokenize.DOT
+    if trailing_dot:
+        i -= 1
+
     name_parts = []
-    trailing_dot = False
-    for token in tokenize_maybe_incomplete(code):
-        if token.type == tokenize.NAME:
-            trailing_dot = False
+    want_name = True
+    while i >= 0:
+        token = tokens[i]
+        if want_name and token.type == tokenize.NAME:
             name_parts.append(token.string)
-        elif token.type in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER):
-            # Some combination of these is added at the end of the input
-            pass
-        elif token.exact_type == tokenize.DOT:
-            trailing_dot = True
-        else:
-            trailing_dot = False
-            name_parts.clear()
+        elif want_name or token.exact_type != tokenize.DOT:
+            break
+        want_name = not want_name
+        i -= 1
+    name_parts.reverse()
 
     if trailing_dot or not name_parts:
         name_parts.append('')
     return tuple(name_parts)
 
 
+class PrefixTrie:
+    """Map name prefixes to the names below them, for tab completion
+
+    Each node is a (children, names) pair: children maps one character to the
+    child node, and names lists every name in the subtree. Names added in
+    sorted order stay sorted in each node.
+    """
+    def __init__(self, names=()):
+        self.root = ({}, [])
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        node = self.root
+        node[1].append(name)
+        for ch in name:
+            node = node[0].setdefault(ch, ({}, []))
+            node[1].append(name)
+
+    def find(self, prefix, node=None):
+        """Get the node for the given prefix (relative to node), or None"""
+        if node is None:
+            node = self.root
+        for ch in prefix:
+            node = node[0].get(ch)
+            if node is None:
+                return None
+        return node
+
+
+class CompletionNamesModel(QtCore.QAbstractListModel):
+    """Names matching the current completion prefix, backed by a prefix trie
+
+    Each character typed descends one edge of the trie from the previous
+    prefix's node, instead of re-filtering the full name list.
+    """
+    def __init__(self, names, parent=None):
+        super().__init__(parent)
+        self.trie = PrefixTrie(names)
+        self._prefix = ''
+        self._node = self.trie.root
+        self._names = self._node[1]
+        self.popup_width = None  # Computed & cached by show_completions
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self._names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self._names[index.row()]
+        return None
+
+    def set_prefix(self, prefix: str):
+        if prefix == self._prefix:
+            return
+        if self._node is not None and prefix.startswith(self._prefix):
+            # Typed more characters: descend from the current node
+            node = self.trie.find(prefix[len(self._prefix):], self._node)
+        else:
+            # Backspace or a different name: re-descend from the root
+            node = self.trie.find(prefix)
+        self.beginResetModel()
+        self._prefix = prefix
+        self._node = node
+        self._names = node[1] if node is not None else []
+        self.endResetModel()
+
+
 class CodeEntry(QtWidgets.QPlainTextEdit):
     # Tab completion machinery largely copied from Qt custom completer example
     # https://doc.qt.io/qt-5/qtwidgets-tools-customcompleter-example.html
+
+    _CTRL_SHIFT = Qt.ControlModifier | Qt.ShiftModifier
+    # Keys the completion popup handles itself
+    _POPUP_KEYS = frozenset(
+        (Qt.Key_Enter, Qt.Key_Return, Qt.Key_Escape, Qt.Key_Tab, Qt.Key_Backtab)
+    )
+
     def __init__(self, namespace, parent=None):
         super().__init__(parent)
         self.namespace = namespace
@@ -117,7 +253,14 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
         self.completer.setWidget(self)
         self.completer.activated[str].connect(self.insertCompletion)
 
-        self._complete_attrs_key = None
+        self._model_cache = collections.OrderedDict()  # attrs key -> model
+        self._model_cache_limit = 16
+        self._popup_sb_width = None
+        self._builtin_names = sorted(dir(builtins))
+        self._namespace_names_key = None
+        self._namespace_names = None
+        self._attr_names_cache = {}  # (id(obj), type(obj)) -> sorted dir(obj)
+        self._attr_names_cache_size = 64
 
     def add_hist_and_reset(self, code):
         self.history.append(code)
@@ -128,6 +271,17 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
         self.new_hist_entry = ""
         self.clear()
 
+        # Running code can add, remove or reassign names, so drop the cached
+        # completion models - they'll be rebuilt on the next completion.
+        for model in self._model_cache.values():
+            if model is not self.completer.model():
+                model.deleteLater()
+        self._model_cache.clear()
+        # The name caches feeding the models can be stale in the same way
+        # (e.g. 'del x' then 'y = 1' leaves the namespace the same size).
+        self._namespace_names_key = None
+        self._attr_names_cache.clear()
+
     def hist_up(self):
         if self.hist_index <= -len(self.history):
             return   # At oldest entry already
@@ -175,42 +329,74 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
                 return super().keyPressEvent(e)
 
         # If we get here, the completion popup was already open
-        if k in (Qt.Key_Enter, Qt.Key_Return, Qt.Key_Escape, Qt.Key_Tab, Qt.Key_Backtab):
+        if k in self._POPUP_KEYS:
             # These keys are handled by the completion popup
             e.ignore()
             return
 
         super().keyPressEvent(e)
-        ctrl_or_shift = bool(e.modifiers() & (Qt.ControlModifier | Qt.ShiftModifier))
-        if ctrl_or_shift and not e.text():
+        text = e.text()
+        ctrl_or_shift = bool(e.modifiers() & self._CTRL_SHIFT)
+        if ctrl_or_shift and not text:
             return  # Ctrl/Shift pressed by itself
 
-        eow = "~!@#$%^&*()_+{}|:\"<>?,./;'[]\\-="  # End Of Word
         if (
                 e.modifiers() in (Qt.NoModifier, Qt.ShiftModifier)
-                and e.text()
-                and e.text()[-1] not in eow
+                and text
+                and (text[-1].isalnum() or text[-1] in '._')
                 and k != Qt.Key_Backspace
         ):
-            self.show_completions()  # Added character, update completions
+            self.show_completions()  # Extended a dotted name, update completions
         else:
             self.completer.popup().hide()
 
     def show_completions(self):
         c = self.completer
-        dotted_name = get_dotted_name(self.textToCursor())
+        dotted_name = get_dotted_name(self.textLineToCursor())
         *attr_of, prefix = dotted_name
-        if attr_of != self._complete_attrs_key:
-            c.setModel(QtCore.QStringListModel(self.find_child_names(attr_of)))
-            self._complete_attrs_key = attr_of
 
+        # Keep a model per attribute path, so flipping between e.g. foo.bar
+        # and foo.baz doesn't rebuild the same model over and over.
+        key = tuple(attr_of)
+        try:
+            model = self._model_cache[key]
+            self._model_cache.move_to_end(key)
+        except KeyError:
+            model = CompletionNamesModel(self.find_child_names(attr_of), self)
+            self._model_cache[key] = model
+            if len(self._model_cache) > self._model_cache_limit:
+                _, evicted = self._model_cache.popitem(last=False)
+                if evicted is not c.model():
+                    evicted.deleteLater()
+
+        old_model = c.model()
+        if old_model is not model:
+            c.setModel(model)
+            # Delete a displaced model which has already dropped out of the
+            # cache (it survived eviction while still set on the completer)
+            if (
+                    isinstance(old_model, CompletionNamesModel)
+                    and old_model not in self._model_cache.values()
+            ):
+                old_model.deleteLater()
+        model.set_prefix(prefix)
         if c.completionPrefix() != prefix:
             c.setCompletionPrefix(prefix)
             c.popup().setCurrentIndex(c.completionModel().index(0, 0))
 
+        # Qt's sizeHintForColumn measures every row, so compute the widest
+        # name once per model (and the scrollbar width once) instead.
+        popup = c.popup()
+        if model.popup_width is None:
+            fm = QtGui.QFontMetrics(popup.font())
+            model.popup_width = max(
+                (fm.horizontalAdvance(n) for n in model.trie.root[1]), default=0
+            ) + 8  # A little extra for the item margins
+        if self._popup_sb_width is None:
+            self._popup_sb_width = popup.verticalScrollBar().sizeHint().width()
+
         cr = self.cursorRect()
-        cr.setWidth(c.popup().sizeHintForColumn(0)
-                    + c.popup().verticalScrollBar().sizeHint().width())
+        cr.setWidth(model.popup_width + self._popup_sb_width)
         c.complete(cr)
 
     def insertCompletion(self, completion: str):
@@ -220,9 +406,9 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
         tc.insertText(completion[len(self.completer.completionPrefix()):])
         self.setTextCursor(tc)
 
-    def textToCursor(self):
+    def textLineToCursor(self):
         tc = self.textCursor()
-        tc.movePosition(QtGui.QTextCursor.Start, QtGui.QTextCursor.KeepAnchor)
+        tc.movePosition(QtGui.QTextCursor.StartOfBlock, QtGui.QTextCursor.KeepAnchor)
         return tc.selectedText()
 
     def textUnderCursor(self):
@@ -232,7 +418,15 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
 
     def find_child_names(self, name_parts):
         if not name_parts:
-            return sorted(list(self.namespace) + dir(builtins))
+            # The builtins don't change, and the namespace rarely does between
+            # consecutive keystrokes, so reuse the merged & sorted list.
+            key = (id(self.namespace), len(self.namespace))
+            if key != self._namespace_names_key:
+                self._namespace_names = sorted(
+                    set(self.namespace).union(self._builtin_names)
+                )
+                self._namespace_names_key = key
+            return self._namespace_names
 
         missing = object()
         obj = self.namespace.get(name_parts[0], missing)
@@ -246,8 +440,23 @@ class CodeEntry(QtWidgets.QPlainTextEdit):
             if obj is missing:
                 return []
 
-        # Sort 'name' before '_name' before '__name', and case-insensitive
-        return sorted(dir(obj), key=lambda n: (len(n) - len(n.lstrip('_')), n.lower()))
+        # Attribute lists rarely change between keystrokes, so cache them.
+        cache_key = (id(obj), type(obj))
+        try:
+            return self._attr_names_cache[cache_key]
+        except KeyError:
+            pass
+
+        # Sort 'name' before '_name' before '__name', and case-insensitive.
+        # Building the keys up front is faster than a lambda call per name.
+        keyed = [(len(n) - len(n.lstrip('_')), n.lower(), n) for n in dir(obj)]
+        keyed.sort()
+        names = [k[2] for k in keyed]
+        if len(self._attr_names_cache) >= self._attr_names_cache_size:
+            # Drop the oldest entry (dicts preserve insertion order)
+            del self._attr_names_cache[next(iter(self._attr_names_cache))]
+        self._attr_names_cache[cache_key] = names
+        return names
 
 
 class AdeqtWidget(QtWidgets.QWidget):
@@ -260,9 +469,25 @@ class AdeqtWidget(QtWidgets.QWidget):
         self.display.document().setDefaultFont(QtGui.QFont("monospace"))
         self.display.setReadOnly(True)
         self.write_cursor = self.display.textCursor()
+        self.write_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        # insertText leaves the cursor at the end, so it only needs re-seeking
+        # if the cursor in the display moves (e.g. the user clicks in it)
+        self._write_cursor_dirty = False
+        self.display.cursorPositionChanged.connect(self._display_cursor_moved)
+        self._vsb = self.display.verticalScrollBar()
         vbox.addWidget(self.display, stretch=3)
         self.output_stream = OutputStream(self)
 
+        # Coalesce rapid writes (e.g. print in a loop) into one text insertion
+        self._write_buf = io.StringIO()
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(16)
+        self._flush_timer.timeout.connect(self.flush_output)
+
+        self._compile_cache = collections.OrderedDict()  # code -> _compile() result
+        self._compile_cache_limit = 128
+
         self.namespace = {'adeqt': self}
         if variables is not None:
             self.namespace.update(variables)
@@ -281,10 +506,24 @@ class AdeqtWidget(QtWidgets.QWidget):
         vbox.addWidget(self.run_button)
 
     def write(self, text):
-        self.write_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        self._write_buf.write(text)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _display_cursor_moved(self):
+        self._write_cursor_dirty = True
+
+    def flush_output(self):
+        self._flush_timer.stop()
+        text = self._write_buf.getvalue()
+        if not text:
+            return
+        self._write_buf = io.StringIO()
+        if self._write_cursor_dirty:
+            self.write_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+            self._write_cursor_dirty = False
         self.write_cursor.insertText(text)
-        vsb = self.display.verticalScrollBar()
-        vsb.setValue(vsb.maximum())  # Scroll to end
+        self._vsb.setValue(self._vsb.maximum())  # Scroll to end
 
     def displayhook(self, value):
         if value is None:
@@ -306,6 +545,52 @@ class AdeqtWidget(QtWidgets.QWidget):
             sys.stdout = save_stdout
             sys.stderr = save_stderr
             sys.displayhook = save_displayhook
+            self.flush_output()
+
+    def _compile(self, code):
+        """Parse & byte-compile code, giving (code_objs, error_text)
+
+        code_objs is a list of code objects to exec - empty if there is
+        nothing to execute, e.g. only comments. On invalid syntax, it is None
+        and error_text holds the formatted error instead.
+        """
+        if '\n' not in code.strip():
+            # Fast path for one-line input, the common interactive case:
+            # 'single' mode both runs statements and shows expression values
+            # via sys.displayhook, with no need to inspect the AST.
+            try:
+                return [compile(code, "<string>", "single")], None
+            except SyntaxError:
+                # Report the error through the normal path below
+                pass
+
+        try:
+            mod = ast.parse(code)
+        except Exception as e:
+            # Invalid syntax
+            es = traceback.format_exception_only(type(e), e)
+            return None, ''.join(es).rstrip() + '\n'
+
+        if not mod.body:
+            return [], None
+
+        try:
+            if isinstance(mod.body[-1], ast.Expr):
+                expr = mod.body.pop()
+                code_objs = []
+                if mod.body:
+                    # Statements before the final expression
+                    code_objs.append(compile(mod, "<string>", "exec"))
+                code_objs.append(
+                    compile(ast.Interactive([expr]), "<string>", "single")
+                )
+            else:
+                code_objs = [compile(mod, "<string>", "exec")]
+        except Exception as e:
+            es = traceback.format_exception_only(type(e), e)
+            return None, ''.join(es).rstrip() + '\n'
+
+        return code_objs, None
 
     def run(self):
         code = self.entry.toPlainText()
@@ -316,40 +601,29 @@ class AdeqtWidget(QtWidgets.QWidget):
 
         self.write(add_prompt(code))
 
+        # Re-running a snippet (e.g. from history) is common, so cache the
+        # compiled code objects keyed on the source string.
+        cache = self._compile_cache
         try:
-            mod = ast.parse(code)
-        except Exception as e:
-            # Invalid syntax
-            es = traceback.format_exception_only(type(e), e)
-            self.write(''.join(es).rstrip() + '\n')
+            code_objs, error_text = cache[code]
+            cache.move_to_end(code)
+        except KeyError:
+            code_objs, error_text = self._compile(code)
+            cache[code] = (code_objs, error_text)
+            if len(cache) > self._compile_cache_limit:
+                cache.popitem(last=False)
+
+        if error_text is not None:
+            self.write(error_text)
             return
 
-        if not mod.body:
-            # No code to execute, e.g. only comments
-            self.entry.add_hist_and_reset(code)
-            return
-
-        if isinstance(mod.body[-1], ast.Expr):
-            expr = mod.body.pop()
-            try:
-                c1 = compile(mod, "<string>", "exec")
-                c2 = compile(ast.Interactive([expr]), "<string>", "single")
-            except Exception as e:
-                es = traceback.format_exception_only(type(e), e)
-                self.write(''.join(es).rstrip() + '\n')
-                return
-            code_objs = [c1, c2]
-        else:
-            try:
-                code_objs = [compile(mod, "<string>", "exec")]
-            except Exception as e:
-                es = traceback.format_exception_only(type(e), e)
-                self.write(''.join(es).rstrip() + '\n')
-                return
-
         # At this point we've parsed & byte-compiled the entered code
         self.entry.add_hist_and_reset(code)
 
+        if not code_objs:
+            # No code to execute, e.g. only comments
+            return
+
         with self.capture_output():
             try:
                 for code_obj in code_objs:
@@ -1,4 +1,38 @@
-from adeqt import AdeqtWindow, AdeqtWidget, CodeEntry
+from adeqt import (
+    AdeqtWindow, AdeqtWidget, CodeEntry, PrefixTrie, add_prompt, get_dotted_name,
+)
+
+
+def test_add_prompt():
+    assert add_prompt("1 + 1\n") == ">>> 1 + 1\n"
+    assert add_prompt("for i in range(3):\n    print(i)") == (
+        ">>> for i in range(3):\n... " + "    print(i)\n"
+    )
+    assert add_prompt("") == "\n"
+
+
+def test_get_dotted_name():
+    assert get_dotted_name("foo.bar") == ('foo', 'bar')
+    assert get_dotted_name("print(foo.bar.") == ('foo', 'bar', '')
+    assert get_dotted_name("1 + 2") == ('',)
+    assert get_dotted_name("") == ('',)
+
+    # These need the tokenize fallback path
+    assert get_dotted_name("foo .bar") == ('foo', 'bar')
+    assert get_dotted_name("foo().bar") == ('bar',)
+    assert get_dotted_name("# comment.foo") == ('',)
+
+
+def test_prefix_trie():
+    trie = PrefixTrie(["bang", "bar", "baz", "foo"])
+    assert trie.root[1] == ["bang", "bar", "baz", "foo"]
+    assert trie.find("ba")[1] == ["bang", "bar", "baz"]
+    assert trie.find("bar")[1] == ["bar"]
+    assert trie.find("q") is None
+
+    # Incremental descent from a previous node
+    node = trie.find("b")
+    assert trie.find("a", node)[1] == ["bang", "bar", "baz"]
 
 
 def test_basic(qtbot):